@@ -27,3 +27,7 @@ else:
     for i in range(len(sentences1)):
         for j in range(len(sentences2)):
             print(f"{sentences1[i]} vs {sentences2[j]}, score: {similarity_scores.numpy()[i][j]:.4f}")
+
+# Reuse precomputed embeddings of sentences1, only sentences2 is encoded
+embeddings1 = m.get_embeddings(sentences1)
+print(f"similarity score with embeddings: {m.similarity(embeddings1, sentences2).numpy()}")
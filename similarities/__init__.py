@@ -37,5 +37,9 @@ from similarities.faiss_clip_similarity import ClipClient, ClipItem
 
 from similarities import utils
 from similarities.utils.get_file import http_get
+from similarities.utils.threads import check_openmp_runtimes, set_num_threads
 from similarities.utils.util import cos_sim, dot_score, pairwise_dot_score, pairwise_cos_sim, normalize_embeddings, \
     semantic_search, paraphrase_mining_embeddings, community_detection
+
+# torch, numpy and faiss are loaded now, warn if they brought different OpenMP runtimes
+check_openmp_runtimes()
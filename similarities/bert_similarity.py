@@ -10,19 +10,45 @@ Compute similarity:
 
 import json
 import os
-from typing import List, Union, Dict
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union, Dict, Optional
 
 import numpy as np
+import torch
 from loguru import logger
 from text2vec import SentenceModel
 
 from similarities.similarity import SimilarityABC
-from similarities.utils.util import cos_sim, semantic_search, dot_score
+from similarities.utils import fast_topk
+from similarities.utils.util import cos_sim, dot_score, normalize_embeddings
 
-os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 os.environ["TOKENIZERS_PARALLELISM"] = "TRUE"
 
 
+class CorpusView(Mapping):
+    """
+    Read-only mapping of corpus id to doc, backed by the doc list of the similarity,
+    avoids the per entry overhead of a dict for large corpus.
+    """
+
+    def __init__(self, similarity: "BertSimilarity"):
+        self._similarity = similarity
+
+    def __getitem__(self, corpus_id):
+        return self._similarity._docs[self._similarity._position(corpus_id)]
+
+    def __iter__(self):
+        return iter(self._similarity._id_list.tolist())
+
+    def __len__(self):
+        return len(self._similarity._docs)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self)})"
+
+
 class BertSimilarity(SimilarityABC):
     """
     Sentence Similarity:
@@ -34,9 +60,15 @@ class BertSimilarity(SimilarityABC):
 
     def __init__(
             self,
-            corpus: Union[List[str], Dict[int, str]] = None,
+            corpus: Union[List[str], Dict[Union[int, str], str]] = None,
             model_name_or_path: str = "shibing624/text2vec-base-chinese",
             device: str = None,
+            faiss_index_factory: str = "OPQ16_64,IVF256,PQ16,RFlat",
+            faiss_index_threshold: Optional[int] = None,
+            nprobe: int = 16,
+            fp16: bool = False,
+            storage_dtype: str = "float32",
+            embedding_cache_size: int = 4096,
     ):
         """
         Initialize the similarity object.
@@ -46,6 +78,18 @@ class BertSimilarity(SimilarityABC):
             model in HuggingFace Model Hub and release from https://github.com/shibing624/text2vec
         :param corpus: Corpus of documents to use for similarity queries.
         :param device: Device (like 'cuda' / 'cpu') to use for the computation.
+        :param faiss_index_factory: faiss index factory string, used to build an ANN index for large corpus,
+            e.g. "SQ8" for int8 scalar quantized exhaustive search, the default "RFlat" suffix re-scores
+            the ANN candidates exactly, so returned scores are true cosine similarities, but the index then keeps
+            a float32 copy of every vector besides the PQ codes, drop it (e.g. "OPQ16_64,IVF256,PQ16") to save memory
+        :param faiss_index_threshold: build the faiss index once corpus size reaches this value,
+            smaller corpus uses exhaustive search, default None disables the faiss index (exact search only),
+            the corpus should have enough docs to train the index, e.g. at least 256 for IVF256/PQ16
+        :param nprobe: number of inverted lists to probe when searching the faiss index
+        :param fp16: use half precision model for inference, only works on cuda device
+        :param storage_dtype: dtype to store corpus embeddings, "float32" or "float16",
+            float16 halves the memory of corpus embeddings, scores are still computed in float32
+        :param embedding_cache_size: max number of text embeddings cached by `similarity`, 0 to disable the cache
         """
         if isinstance(model_name_or_path, str):
             self.sentence_model = SentenceModel(
@@ -56,15 +100,97 @@ class BertSimilarity(SimilarityABC):
             self.sentence_model = model_name_or_path
         else:
             raise ValueError("model_name_or_path is transformers model name or path")
+        if fp16:
+            self._half_model()
+        if np.dtype(storage_dtype) not in (np.float32, np.float16):
+            raise ValueError(f"storage_dtype: {storage_dtype} must be either float32 or float16")
+        self.storage_dtype = np.dtype(storage_dtype)
         self.score_functions = {'cos_sim': cos_sim, 'dot': dot_score}
-        self.corpus = {}
-        self.corpus_embeddings = []
+        self._docs = []
+        self._doc_set = set()
+        self._corpus_embeddings = np.empty((0, 0), dtype=self.storage_dtype)
+        self._n = 0
+        self._normalized = True
+        self._corpus_tensor = None
+        self.embedding_cache_size = embedding_cache_size
+        self._embedding_cache = OrderedDict()
+        self._reset_ids()
+        self.faiss_index_factory = faiss_index_factory
+        self.faiss_index_threshold = faiss_index_threshold
+        self.nprobe = nprobe
+        self.faiss_index = None
         if corpus is not None:
             self.add_corpus(corpus)
 
+    def _half_model(self):
+        """Convert the sentence model to half precision for faster inference on GPU."""
+        model_device = torch.device(getattr(self.sentence_model, "device", "cpu"))
+        if model_device.type != "cuda":
+            logger.warning(f"fp16 is only supported on cuda device, now device: {model_device}, use fp32 instead.")
+            return
+        model = getattr(self.sentence_model, "bert", self.sentence_model)
+        if hasattr(model, "half"):
+            model.half()
+            logger.debug("Use fp16 sentence model.")
+
     def __len__(self):
         """Get length of corpus."""
-        return len(self.corpus)
+        return len(self._docs)
+
+    @property
+    def corpus(self) -> CorpusView:
+        """Corpus of documents, read-only mapping of corpus id to doc."""
+        return CorpusView(self)
+
+    def _position(self, corpus_id) -> int:
+        """Get the position (row of corpus embeddings) of a corpus id."""
+        if self._id_to_pos is not None:
+            return self._id_to_pos[corpus_id]
+        if isinstance(corpus_id, (int, np.integer)) and 0 <= corpus_id < len(self._docs):
+            return int(corpus_id)
+        raise KeyError(corpus_id)
+
+    @property
+    def _id_list(self) -> np.ndarray:
+        """Corpus ids, the id of each row of corpus embeddings."""
+        return self._ids[:self._num_ids]
+
+    def _reset_ids(self):
+        """Remove all corpus ids."""
+        self._ids = np.empty(0, dtype=np.int64)
+        self._num_ids = 0
+        self._max_int_id = -1
+        self._id_to_pos = None
+
+    def _add_ids(self, corpus_ids: list):
+        """
+        Append corpus ids of new docs to the id buffer, grow its capacity geometrically when full,
+        build id to position map only if ids are not positions.
+        Integer ids are stored in an int64 array, other ids (e.g. str) in an object array.
+        """
+        start = self._num_ids
+        if self._ids.dtype != object and all(isinstance(i, (int, np.integer)) for i in corpus_ids):
+            corpus_ids = np.asarray(corpus_ids, dtype=np.int64)
+            int_ids = corpus_ids
+        else:
+            ids = np.empty(len(corpus_ids), dtype=object)
+            for i, corpus_id in enumerate(corpus_ids):
+                ids[i] = corpus_id
+            corpus_ids = ids
+            int_ids = [i for i in corpus_ids.tolist() if isinstance(i, (int, np.integer))]
+        if len(int_ids):
+            self._max_int_id = max(self._max_int_id, int(np.max(int_ids)))
+        if self._id_to_pos is None and not np.array_equal(corpus_ids, np.arange(start, start + len(corpus_ids))):
+            self._id_to_pos = {corpus_id: pos for pos, corpus_id in enumerate(self._id_list.tolist())}
+        if self._id_to_pos is not None:
+            self._id_to_pos.update(zip(corpus_ids.tolist(), range(start, start + len(corpus_ids))))
+        needed = start + len(corpus_ids)
+        if needed > len(self._ids) or self._ids.dtype != corpus_ids.dtype:
+            buffer = np.empty(max(2 * len(self._ids), needed), dtype=corpus_ids.dtype)
+            buffer[:start] = self._ids[:start]
+            self._ids = buffer
+        self._ids[start:needed] = corpus_ids
+        self._num_ids = needed
 
     def __str__(self):
         base = f"Similarity: {self.__class__.__name__}, matching_model: {self.sentence_model}"
@@ -72,6 +198,52 @@ class BertSimilarity(SimilarityABC):
             base += f", corpus size: {len(self.corpus)}"
         return base
 
+    @property
+    def corpus_embeddings(self) -> np.ndarray:
+        """Corpus embeddings, array of shape (corpus size, embedding dim) with dtype `storage_dtype`."""
+        return self._corpus_embeddings[:self._n]
+
+    @corpus_embeddings.setter
+    def corpus_embeddings(self, embeddings):
+        if len(embeddings) == 0:
+            self._corpus_embeddings = np.empty((0, 0), dtype=self.storage_dtype)
+        else:
+            self._corpus_embeddings = np.asarray(embeddings, dtype=self.storage_dtype)
+        self._n = len(self._corpus_embeddings)
+        self._corpus_tensor = None
+
+    def _add_embeddings(self, embeddings: np.ndarray):
+        """Append embeddings to the preallocated corpus buffer, grow its capacity geometrically when full."""
+        num = len(embeddings)
+        if num == 0:
+            return
+        needed = self._n + num
+        capacity = len(self._corpus_embeddings)
+        if needed > capacity or not self._corpus_embeddings.flags.writeable:
+            buffer = np.empty((max(2 * capacity, needed), embeddings.shape[1]), dtype=self.storage_dtype)
+            if self._n:
+                buffer[:self._n] = self._corpus_embeddings[:self._n]
+            self._corpus_embeddings = buffer
+        self._corpus_embeddings[self._n:needed] = embeddings
+        self._n = needed
+        self._corpus_tensor = None
+
+    def _get_corpus_tensor(self) -> Optional[torch.Tensor]:
+        """
+        Get corpus embeddings cached on the model device when the model runs on cuda,
+        so the corpus is copied to GPU once instead of every search. Returns None for cpu model.
+        """
+        model_device = torch.device(getattr(self.sentence_model, "device", "cpu"))
+        if model_device.type != "cuda":
+            return None
+        if self._corpus_tensor is None:
+            embeddings = self.corpus_embeddings
+            if not embeddings.flags.writeable:
+                # torch.from_numpy warns on read-only arrays, e.g. the memory-mapped corpus from load_corpus_embeddings
+                embeddings = np.array(embeddings)
+            self._corpus_tensor = torch.from_numpy(embeddings).to(model_device)
+        return self._corpus_tensor
+
     def get_sentence_embedding_dimension(self):
         """
         Get the dimension of the sentence embeddings.
@@ -86,7 +258,7 @@ class BertSimilarity(SimilarityABC):
         else:
             return getattr(self.sentence_model.bert.pooler.dense, "out_features", None)
 
-    def add_corpus(self, corpus: Union[List[str], Dict[int, str]], batch_size: int = 32,
+    def add_corpus(self, corpus: Union[List[str], Dict[Union[int, str], str]], batch_size: int = 32,
                    normalize_embeddings: bool = True):
         """
         Extend the corpus with new documents.
@@ -95,29 +267,91 @@ class BertSimilarity(SimilarityABC):
         :param normalize_embeddings: normalize embeddings before computing similarity
         :return: corpus, corpus embeddings
         """
-        new_corpus = {}
-        start_id = len(self.corpus) if self.corpus else 0
-        for id, doc in enumerate(corpus):
-            if isinstance(corpus, list):
-                if doc not in self.corpus.values():
-                    new_corpus[start_id + id] = doc
-            else:
-                if doc not in self.corpus.values():
-                    new_corpus[id] = doc
-        self.corpus.update(new_corpus)
-        logger.info(f"Start computing corpus embeddings, new docs: {len(new_corpus)}")
+        new_docs, new_ids = [], []
+        # List docs get their positions as corpus ids, dict docs keep the given ids
+        start_id = len(self._docs) if self._id_to_pos is None else self._max_int_id + 1
+        items = corpus.items() if isinstance(corpus, dict) else ((None, doc) for doc in corpus)
+        for id, doc in items:
+            if doc in self._doc_set or (id is not None and id in self.corpus):
+                continue
+            new_ids.append(start_id + len(new_docs) if id is None else id)
+            new_docs.append(doc)
+            self._doc_set.add(doc)
+        if not new_docs:
+            logger.info(f"No new docs to add, total: {len(self._docs)}")
+            return
+        self._docs.extend(new_docs)
+        self._add_ids(new_ids)
+        logger.info(f"Start computing corpus embeddings, new docs: {len(new_docs)}")
         corpus_embeddings = self.get_embeddings(
-            list(new_corpus.values()),
+            new_docs,
             batch_size=batch_size,
             show_progress_bar=True,
             normalize_embeddings=normalize_embeddings,
             convert_to_numpy=True,
-        ).tolist()
-        if self.corpus_embeddings:
-            self.corpus_embeddings = self.corpus_embeddings + corpus_embeddings
-        else:
-            self.corpus_embeddings = corpus_embeddings
-        logger.info(f"Add {len(new_corpus)} docs, total: {len(self.corpus)}, emb len: {len(self.corpus_embeddings)}")
+        )
+        self._add_embeddings(corpus_embeddings)
+        self._normalized = self._normalized and normalize_embeddings
+        logger.info(f"Add {len(new_docs)} docs, total: {len(self._docs)}, emb len: {len(self.corpus_embeddings)}")
+        if self.faiss_index is not None:
+            self.faiss_index.add(self._normalize_array(corpus_embeddings))
+        elif self._need_faiss_index():
+            self.build_faiss_index()
+
+    @staticmethod
+    def _is_normalized(embeddings: np.ndarray, atol: float = 1e-3, sample_size: int = 1000):
+        """
+        Whether embeddings have unit length, only the first `sample_size` rows are checked,
+        so a memory-mapped corpus is not read (and float16 corpus not upcast) entirely.
+        """
+        embeddings = np.asarray(embeddings[:sample_size], dtype=np.float32)
+        return bool(np.all(np.abs(np.einsum('ij,ij->i', embeddings, embeddings) - 1) < atol))
+
+    def _need_faiss_index(self):
+        """Whether the corpus is large enough to build the faiss index."""
+        return self.faiss_index_threshold is not None and 0 < self._n >= self.faiss_index_threshold
+
+    @staticmethod
+    def _normalize_array(embeddings):
+        """Convert embeddings to contiguous, L2-normalized float32 array, for inner product search."""
+        emb = np.ascontiguousarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(emb, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return emb / norms
+
+    @staticmethod
+    def _import_faiss():
+        try:
+            import faiss
+        except ImportError:
+            raise ImportError("Faiss is not installed. Please install it first, e.g. with `pip install faiss-cpu`.")
+        return faiss
+
+    def _set_nprobe(self, index):
+        """Set nprobe of the IVF index, if any."""
+        index_ivf = self._import_faiss().try_extract_index_ivf(index)
+        if index_ivf is not None:
+            index_ivf.nprobe = self.nprobe
+
+    def build_faiss_index(self):
+        """
+        Build faiss index of the corpus embeddings, used by most_similar with cos_sim.
+        If the corpus is too small to train the index, exhaustive search is used instead.
+        """
+        faiss = self._import_faiss()
+        emb = self._normalize_array(self.corpus_embeddings)
+        index = faiss.index_factory(emb.shape[1], self.faiss_index_factory, faiss.METRIC_INNER_PRODUCT)
+        logger.info(f"Building faiss index: {self.faiss_index_factory}, corpus size: {len(emb)}")
+        try:
+            index.train(emb)
+        except RuntimeError as e:
+            logger.warning(f"Corpus size {len(emb)} is too small to train faiss index: {self.faiss_index_factory}, "
+                           f"use exhaustive search instead. {e}")
+            self.faiss_index = None
+            return
+        index.add(emb)
+        self._set_nprobe(index)
+        self.faiss_index = index
 
     def get_embeddings(
             self,
@@ -129,8 +363,17 @@ class BertSimilarity(SimilarityABC):
             device: str = None,
             normalize_embeddings: bool = True,
     ):
-        """Returns the embeddings for a batch of sentences."""
-        return self.sentence_model.encode(
+        """
+        Returns the embeddings for a batch of sentences.
+
+        Sentences are encoded in length-sorted order, so each batch is padded to similar lengths,
+        the embeddings are returned in the input order.
+        """
+        order = None
+        if isinstance(sentences, list) and len(sentences) > batch_size:
+            order = np.argsort([len(s) for s in sentences], kind="stable")
+            sentences = [sentences[i] for i in order]
+        embeddings = self.sentence_model.encode(
             sentences,
             batch_size=batch_size,
             show_progress_bar=show_progress_bar,
@@ -139,12 +382,27 @@ class BertSimilarity(SimilarityABC):
             device=device,
             normalize_embeddings=normalize_embeddings,
         )
+        if order is None:
+            return embeddings
+        inverse = np.empty(len(order), dtype=np.int64)
+        inverse[order] = np.arange(len(order))
+        if isinstance(embeddings, torch.Tensor):
+            return embeddings[torch.from_numpy(inverse).to(embeddings.device)]
+        if isinstance(embeddings, list):
+            return [embeddings[i] for i in inverse]
+        return embeddings[inverse]
 
-    def similarity(self, a: Union[str, List[str]], b: Union[str, List[str]], score_function: str = "cos_sim", **kwargs):
+    def similarity(
+            self,
+            a: Union[str, List[str], np.ndarray, torch.Tensor],
+            b: Union[str, List[str], np.ndarray, torch.Tensor],
+            score_function: str = "cos_sim",
+            **kwargs
+    ):
         """
         Compute similarity between two texts.
-        :param a: list of str or str
-        :param b: list of str or str
+        :param a: list of str or str, or precomputed embeddings (np.ndarray / torch.Tensor) to skip encoding
+        :param b: list of str or str, or precomputed embeddings (np.ndarray / torch.Tensor) to skip encoding
         :param score_function: function to compute similarity, default cos_sim
         :param kwargs: additional arguments for the similarity function
         :return: similarity score, torch.Tensor, Matrix with res[i][j] = cos_sim(a[i], b[j])
@@ -153,15 +411,55 @@ class BertSimilarity(SimilarityABC):
             raise ValueError(f"score function: {score_function} must be either (cos_sim) for cosine similarity"
                              " or (dot) for dot product")
         score_function = self.score_functions[score_function]
-        text_emb1 = self.get_embeddings(a, **kwargs)
-        text_emb2 = self.get_embeddings(b, **kwargs)
+        is_emb1 = isinstance(a, (np.ndarray, torch.Tensor))
+        is_emb2 = isinstance(b, (np.ndarray, torch.Tensor))
+        texts1 = [] if is_emb1 else [a] if isinstance(a, str) else list(a)
+        texts2 = [] if is_emb2 else [b] if isinstance(b, str) else list(b)
+        text_emb1 = torch.as_tensor(a).float() if is_emb1 else None
+        text_emb2 = torch.as_tensor(b).float() if is_emb2 else None
+        if (not is_emb1 and not texts1) or (not is_emb2 and not texts2):
+            # Empty text input, nothing to score
+            num1 = len(texts1) if text_emb1 is None else (1 if text_emb1.dim() == 1 else len(text_emb1))
+            num2 = len(texts2) if text_emb2 is None else (1 if text_emb2.dim() == 1 else len(text_emb2))
+            return torch.empty((num1, num2))
+        if texts1 or texts2:
+            # Encode the texts of a and b together, so repeated texts (e.g. symmetric pairs) are encoded once
+            embeddings = self._get_cached_embeddings(texts1 + texts2, **kwargs)
+            if not is_emb1:
+                text_emb1 = embeddings[:len(texts1)]
+            if not is_emb2:
+                text_emb2 = embeddings[len(texts1):]
 
-        return score_function(text_emb1, text_emb2)
+        return score_function(text_emb1, text_emb2.to(text_emb1.device))
 
     def distance(self, a: Union[str, List[str]], b: Union[str, List[str]]):
         """Compute cosine distance between two texts."""
         return 1 - self.similarity(a, b)
 
+    def _get_cached_embeddings(self, texts: List[str], **kwargs) -> torch.Tensor:
+        """
+        Get float32 embeddings of texts with a LRU cache of text embeddings,
+        each distinct text not in the cache is encoded once.
+        """
+        kwargs.pop("convert_to_numpy", None)
+        kwargs.pop("convert_to_tensor", None)
+        settings = tuple(sorted(kwargs.items()))
+        missing = list(dict.fromkeys(text for text in texts if (text, settings) not in self._embedding_cache))
+        embeddings = {}
+        if missing:
+            # fp16 model outputs are scored in fp32
+            missing_embeddings = self.get_embeddings(missing, convert_to_tensor=True, **kwargs).float()
+            embeddings = {(text, settings): emb.clone() for text, emb in zip(missing, missing_embeddings)}
+        for key in dict.fromkeys((text, settings) for text in texts):
+            if key in self._embedding_cache:
+                self._embedding_cache.move_to_end(key)
+                embeddings[key] = self._embedding_cache[key]
+            elif self.embedding_cache_size > 0:
+                self._embedding_cache[key] = embeddings[key]
+        while len(self._embedding_cache) > self.embedding_cache_size:
+            self._embedding_cache.popitem(last=False)
+        return torch.stack([embeddings[(text, settings)] for text in texts])
+
     def most_similar(self, queries: Union[str, List[str], Dict[int, str]], topn: int = 10,
                      score_function: str = "cos_sim", **kwargs):
         """
@@ -177,47 +475,206 @@ class BertSimilarity(SimilarityABC):
             queries = [queries]
         if isinstance(queries, list):
             queries = {id: query for id, query in enumerate(queries)}
+        result = {qid: {} for qid, query in queries.items()}
+        queries_ids_map = {i: id for i, id in enumerate(list(queries.keys()))}
+        rows, scores = self._most_similar_rows(list(queries.values()), topn, score_function, **kwargs)
+        corpus_ids = self._rows_to_ids(rows)
+        # Package each query row with one tolist/zip, only rows padded by faiss (row -1) need filtering,
+        # padding is found from the rows, since -1 may be a valid corpus id
+        valid = rows >= 0
+        has_padding = ~valid.all(axis=1)
+        for idx, (ids_row, scores_row) in enumerate(zip(corpus_ids.tolist(), scores.tolist())):
+            if has_padding[idx]:
+                ids_row = corpus_ids[idx][valid[idx]].tolist()
+                scores_row = scores[idx][valid[idx]].tolist()
+            result[queries_ids_map[idx]] = dict(zip(ids_row, scores_row))
+
+        return result
+
+    def most_similar_arrays(self, queries: Union[str, List[str]], topn: int = 10,
+                            score_function: str = "cos_sim", query_chunk_size: int = 100, **kwargs):
+        """
+        Find the topn most similar texts to the queries against the corpus, return numpy arrays instead of dict.
+        :param queries: str or list of str
+        :param topn: int
+        :param score_function: function to compute similarity, default cos_sim
+        :param query_chunk_size: number of queries encoded and searched at once, the corpus is scanned once per chunk,
+            each chunk is encoded in batches of `batch_size`
+        :param kwargs: additional arguments for the similarity function
+        :return: (corpus_ids, scores), np.ndarray of shape (num queries, k), k = min(topn, corpus size),
+            sorted by decreasing score, corpus_id is -1 if less than k hits are found
+        """
+        rows, scores = self._most_similar_rows(queries, topn, score_function, query_chunk_size, **kwargs)
+        return self._rows_to_ids(rows), scores
+
+    def _rows_to_ids(self, rows: np.ndarray) -> np.ndarray:
+        """Map rows of corpus embeddings to corpus ids, padding row -1 is mapped to -1."""
+        if self._id_to_pos is None:
+            return rows
+        return np.where(rows >= 0, self._id_list[rows], -1)
+
+    def _most_similar_rows(self, queries: Union[str, List[str]], topn: int = 10,
+                           score_function: str = "cos_sim", query_chunk_size: int = 100, **kwargs):
+        """
+        Find the topn most similar rows of corpus embeddings to the queries, see `most_similar_arrays`.
+        :return: (rows, scores), np.ndarray of shape (num queries, k), row is -1 if less than k hits are found
+        """
+        if isinstance(queries, str):
+            queries = [queries]
         if score_function not in self.score_functions:
             raise ValueError(f"score function: {score_function} must be either (cos_sim) for cosine similarity"
                              " or (dot) for dot product")
         score_function = self.score_functions[score_function]
-        result = {qid: {} for qid, query in queries.items()}
-        queries_ids_map = {i: id for i, id in enumerate(list(queries.keys()))}
-        queries_texts = list(queries.values())
-        queries_embeddings = self.get_embeddings(queries_texts, convert_to_tensor=True, **kwargs)
-        corpus_embeddings = np.array(self.corpus_embeddings, dtype=np.float32)
-        all_hits = semantic_search(queries_embeddings, corpus_embeddings, top_k=topn, score_function=score_function)
-        for idx, hits in enumerate(all_hits):
-            for hit in hits[0:topn]:
-                result[queries_ids_map[idx]][hit['corpus_id']] = hit['score']
+        topn = min(topn, self._n)
+        # Encode the next chunk of queries in background while searching the current one
+        chunks = [queries[i:i + query_chunk_size] for i in range(0, len(queries), query_chunk_size)]
+        all_rows = [np.empty((0, topn), dtype=np.int64)]
+        all_scores = [np.empty((0, topn), dtype=np.float32)]
 
-        return result
+        def encode(texts):
+            return self.get_embeddings(texts, convert_to_tensor=True, **kwargs).float()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(encode, chunks[0]) if chunks else None
+            for i in range(len(chunks)):
+                queries_embeddings = future.result()
+                if i + 1 < len(chunks):
+                    future = executor.submit(encode, chunks[i + 1])
+                rows, scores = self._search_embeddings(queries_embeddings, topn, score_function)
+                all_rows.append(rows)
+                all_scores.append(scores)
+        return np.concatenate(all_rows), np.concatenate(all_scores)
+
+    def _search_embeddings(self, queries_embeddings: torch.Tensor, topn: int, score_function,
+                           corpus_chunk_size: int = 500000):
+        """
+        Search the corpus with query embeddings.
+        :return: (rows, scores), np.ndarray of shape (num queries, topn), rows of corpus embeddings
+            sorted by decreasing score, row is -1 if less than topn hits are found
+        """
+        if topn == 0:
+            empty = np.empty((len(queries_embeddings), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        if self.faiss_index is not None and score_function is cos_sim:
+            scores, rows = self.faiss_index.search(self._normalize_array(queries_embeddings.cpu().numpy()), topn)
+            return rows, scores
+        if score_function is cos_sim and self._normalized:
+            # Corpus embeddings are unit vectors, cosine similarity reduces to dot product of normalized queries
+            queries_embeddings = normalize_embeddings(queries_embeddings)
+            score_function = dot_score
+        corpus_embeddings = self._get_corpus_tensor()
+        if corpus_embeddings is None:
+            return self._search_arrays(queries_embeddings.cpu().numpy(), topn, score_function is cos_sim,
+                                       corpus_chunk_size)
+        queries_embeddings = queries_embeddings.to(corpus_embeddings.device, torch.float32)
+        top_scores, top_rows = [], []
+        for start_idx in range(0, self._n, corpus_chunk_size):
+            # Upcast float16 corpus chunk by chunk on the device, scores are computed in float32
+            chunk = corpus_embeddings[start_idx:start_idx + corpus_chunk_size].float()
+            scores, rows = torch.topk(score_function(queries_embeddings, chunk), min(topn, len(chunk)), dim=1)
+            top_scores.append(scores)
+            top_rows.append(rows + start_idx)
+        scores, order = torch.topk(torch.cat(top_scores, dim=1), topn, dim=1)
+        rows = torch.gather(torch.cat(top_rows, dim=1), 1, order)
+        # Only the topn results are copied back from GPU, not the whole score matrix
+        return rows.cpu().numpy(), scores.cpu().numpy()
+
+    def _search_arrays(self, queries_embeddings: np.ndarray, topn: int, normalize: bool, corpus_chunk_size: int):
+        """
+        Exhaustive search on cpu, scores each corpus chunk with a single multithreaded BLAS matmul,
+        or block by block with the numba top-k merge kernel if the score matrix does not fit in L3 cache.
+        :param normalize: normalize queries and corpus before dot product, i.e. cosine similarity
+        :return: (rows, scores), np.ndarray of shape (num queries, topn), sorted by decreasing score
+        """
+        queries_embeddings = np.ascontiguousarray(queries_embeddings, dtype=np.float32)
+        if normalize:
+            queries_embeddings = self._normalize_array(queries_embeddings)
+        top_scores, top_rows = [], []
+        for start_idx in range(0, self._n, corpus_chunk_size):
+            # Upcast float16 corpus chunk by chunk, so the full float32 copy of corpus embeddings is never created
+            chunk = np.asarray(self.corpus_embeddings[start_idx:start_idx + corpus_chunk_size], dtype=np.float32)
+            if normalize:
+                chunk = self._normalize_array(chunk)
+            k = min(topn, len(chunk))
+            if fast_topk.is_available() and len(queries_embeddings) * len(chunk) * 4 > fast_topk.L3_CACHE_BYTES:
+                rows, scores = fast_topk.topk_inner_product(queries_embeddings, chunk, k)
+                top_scores.append(scores)
+            else:
+                scores = queries_embeddings @ chunk.T
+                rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                top_scores.append(np.take_along_axis(scores, rows, axis=1))
+            top_rows.append(rows + start_idx)
+        scores = np.concatenate(top_scores, axis=1)
+        rows = np.concatenate(top_rows, axis=1)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :topn]
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(scores, order, axis=1)
 
     def save_corpus_embeddings(self, emb_path: str = "bert_corpus_emb.jsonl"):
         """
-        Save corpus embeddings to jsonl file.
+        Save corpus to jsonl file, corpus embeddings to binary npy file `{emb_path}.npy`,
+        and whether the embeddings are normalized to `{emb_path}.meta.json`,
+        the faiss index (if built) is saved to `{emb_path}.index`.
         :param emb_path: jsonl file path
         :return:
         """
         with open(emb_path, "w", encoding="utf-8") as f:
-            for id, emb in zip(self.corpus.keys(), self.corpus_embeddings):
-                json_obj = {"id": id, "doc": self.corpus[id], "doc_emb": list(emb)}
+            for id, doc in zip(self._id_list.tolist(), self._docs):
+                json_obj = {"id": id, "doc": doc}
                 f.write(json.dumps(json_obj, ensure_ascii=False) + "\n")
-        logger.debug(f"Save corpus embeddings to file: {emb_path}.")
+        np.save(f"{emb_path}.npy", self.corpus_embeddings)
+        with open(f"{emb_path}.meta.json", "w", encoding="utf-8") as f:
+            json.dump({"normalized": self._normalized}, f)
+        if self.faiss_index is not None:
+            self._import_faiss().write_index(self.faiss_index, f"{emb_path}.index")
+        elif os.path.exists(f"{emb_path}.index"):
+            # Remove the stale index of a previous corpus
+            os.remove(f"{emb_path}.index")
+        logger.debug(f"Save corpus embeddings to file: {emb_path}, {emb_path}.npy")
 
     def load_corpus_embeddings(self, emb_path: str = "bert_corpus_emb.jsonl"):
         """
-        Load corpus embeddings from jsonl file.
+        Load corpus from jsonl file, and corpus embeddings from npy file `{emb_path}.npy`,
+        the npy file is memory-mapped, so embeddings are read from disk lazily.
+        The saved faiss index `{emb_path}.index` is loaded instead of retraining it.
+        Old jsonl files with `doc_emb` field are also supported.
         :param emb_path: jsonl file path
         :return:
         """
         try:
+            npy_path = f"{emb_path}.npy"
             with open(emb_path, "r", encoding="utf-8") as f:
-                corpus_embeddings = []
+                docs, corpus_ids, corpus_embeddings = [], [], []
                 for line in f:
                     json_obj = json.loads(line)
-                    self.corpus[int(json_obj["id"])] = json_obj["doc"]
-                    corpus_embeddings.append(json_obj["doc_emb"])
+                    corpus_ids.append(json_obj["id"])
+                    docs.append(json_obj["doc"])
+                    if "doc_emb" in json_obj:
+                        corpus_embeddings.append(json_obj["doc_emb"])
+                if os.path.exists(npy_path):
+                    corpus_embeddings = np.load(npy_path, mmap_mode="r")
+                if len(corpus_embeddings) != len(docs):
+                    logger.error(f"Error: corpus embeddings size {len(corpus_embeddings)} does not match docs size "
+                                 f"{len(docs)}, missing or stale embeddings file: {npy_path}, corpus not loaded.")
+                    return
                 self.corpus_embeddings = corpus_embeddings
-        except (IOError, json.JSONDecodeError):
+                self._docs = docs
+                self._reset_ids()
+                self._add_ids(corpus_ids)
+                self._doc_set = set(docs)
+                meta_path = f"{emb_path}.meta.json"
+                if os.path.exists(meta_path):
+                    with open(meta_path, "r", encoding="utf-8") as meta_file:
+                        self._normalized = bool(json.load(meta_file)["normalized"])
+                else:
+                    self._normalized = self._is_normalized(self.corpus_embeddings)
+            self.faiss_index = None
+            index_path = f"{emb_path}.index"
+            if self._need_faiss_index() and os.path.exists(index_path):
+                index = self._import_faiss().read_index(index_path)
+                if index.ntotal == self._n:
+                    self._set_nprobe(index)
+                    self.faiss_index = index
+            if self.faiss_index is None and self._need_faiss_index():
+                self.build_faiss_index()
+        except (IOError, ValueError):
             logger.error("Error: Could not load corpus embeddings from file.")
@@ -139,26 +139,36 @@ class EnsembleSimilarity(SimilarityABC):
         if isinstance(queries, list):
             queries = {id: query for id, query in enumerate(queries)}
         result = {qid: {} for qid, query in queries.items()}
+        queries_texts = list(queries.values())
+        # Ranked doc ids of each query, for each similarity method
+        all_ranked_doc_ids = [self._ranked_doc_ids(similarity, queries_texts, topn) for similarity in self.similarities]
         # Calculate weighted reciprocal rank fusion for each query
-        for qid, query in queries.items():
+        for idx, qid in enumerate(queries):
             # Store RRF scores for each document in corpus
             rrf_scores = {}
 
             # Calculate RRF scores for each similarity method
-            for similarity, weight in zip(self.similarities, self.weights):
-                top_docs = similarity.most_similar(query, topn=topn)
-
+            for ranked_doc_ids, weight in zip(all_ranked_doc_ids, self.weights):
                 # For each similar document, calculate its RRF score
-                if top_docs and len(list(top_docs.values())[0]) > 0:
-                    for _qid, doc_scores in top_docs.items():
-                        for rank, (doc_id, score) in enumerate(doc_scores.items()):
-                            rrf_score = weight / (rank + self.c)
-                            rrf_scores[doc_id] = rrf_scores.get(doc_id, 0) + rrf_score
+                for rank, doc_id in enumerate(ranked_doc_ids[idx]):
+                    rrf_score = weight / (rank + self.c)
+                    rrf_scores[doc_id] = rrf_scores.get(doc_id, 0) + rrf_score
             # Order by scores and get only topn
             sorted_by_score = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)[:topn]
             result[qid] = {doc_id: score for doc_id, score in sorted_by_score}
         return result
 
+    @staticmethod
+    def _ranked_doc_ids(similarity: SimilarityABC, queries: List[str], topn: int):
+        """Get the topn doc ids of each query by decreasing score, use numpy arrays result if supported."""
+        if hasattr(similarity, "_most_similar_rows"):
+            # Padding (row -1) is found from the rows, since -1 may be a valid corpus id
+            rows, _ = similarity._most_similar_rows(queries, topn=topn)
+            corpus_ids = similarity._rows_to_ids(rows)
+            return [corpus_ids[idx][rows[idx] >= 0].tolist() for idx in range(len(rows))]
+        top_docs = similarity.most_similar(queries, topn=topn)
+        return [list(top_docs[idx].keys()) for idx in range(len(queries))]
+
     def save_corpus_embeddings(self, emb_dir: str = "corpus_embs"):
         """
         Save corpus embeddings to jsonl file.
@@ -182,9 +192,10 @@ class EnsembleSimilarity(SimilarityABC):
             if hasattr(i, "load_corpus_embeddings"):
                 load_path = os.path.join(emb_dir, f"{i.__class__.__name__}_corpus_emb.jsonl")
                 i.load_corpus_embeddings(load_path)
-                corpus = i.corpus
+                # Copy to a dict, the corpus of a similarity may be a read-only view (e.g. BertSimilarity)
+                corpus = dict(i.corpus)
                 if not self.corpus:
                     self.corpus = corpus
         for i in self.similarities:
             if not hasattr(i, "load_corpus_embeddings") and corpus:
-                i.corpus = corpus
+                i.corpus = dict(corpus)
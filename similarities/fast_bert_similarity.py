@@ -6,6 +6,7 @@
 import os
 from typing import List, Union, Dict
 
+import numpy as np
 from loguru import logger
 
 from similarities.bert_similarity import BertSimilarity
@@ -24,11 +25,11 @@ class AnnoySimilarity(BertSimilarity):
             n_trees: int = 256,
             device: str = None
     ):
-        super().__init__(corpus, model_name_or_path, device=device)
+        super().__init__(corpus, model_name_or_path, device=device, faiss_index_threshold=None)
         self.index = None
         self.embedding_size = self.get_sentence_embedding_dimension()
         self.n_trees = n_trees
-        if corpus is not None and self.corpus_embeddings:
+        if corpus is not None and len(self.corpus_embeddings):
             self.build_index()
 
     def __str__(self):
@@ -81,32 +82,30 @@ class AnnoySimilarity(BertSimilarity):
         else:
             logger.warning("No index path given. Index not loaded.")
 
-    def most_similar(self, queries: Union[str, List[str], Dict[str, str]], topn: int = 10,
-                     score_function: str = "cos_sim", **kwargs):
-        """Find the topn most similar texts to the query against the corpus."""
-        result = {}
-        if self.corpus_embeddings and self.index is None:
+    def _most_similar_rows(self, queries: Union[str, List[str]], topn: int = 10,
+                           score_function: str = "cos_sim", query_chunk_size: int = 100, **kwargs):
+        """Find the topn most similar rows of corpus embeddings to the query, return numpy arrays."""
+        if len(self.corpus_embeddings) and self.index is None:
             logger.warning(f"No index found. Please add corpus and build index first, e.g. with `build_index()`."
                            f"Now returning slow search result.")
-            return super().most_similar(queries, topn, score_function=score_function)
-        if not self.corpus_embeddings:
-            logger.error("No corpus_embeddings found. Please add corpus first, e.g. with `add_corpus()`.")
-            return result
-        if isinstance(queries, str) or not hasattr(queries, '__len__'):
+            return super()._most_similar_rows(queries, topn, score_function=score_function,
+                                              query_chunk_size=query_chunk_size, **kwargs)
+        if isinstance(queries, str):
             queries = [queries]
-        if isinstance(queries, list):
-            queries = {id: query for id, query in enumerate(queries)}
-        result = {qid: {} for qid, query in queries.items()}
-        queries_texts = list(queries.values())
-        queries_embeddings = self.get_embeddings(queries_texts, **kwargs)
+        topn = min(topn, len(self.corpus_embeddings))
+        corpus_rows = np.full((len(queries), topn), -1, dtype=np.int64)
+        scores = np.zeros((len(queries), topn), dtype=np.float32)
+        if not len(self.corpus_embeddings):
+            logger.error("No corpus_embeddings found. Please add corpus first, e.g. with `add_corpus()`.")
+            return corpus_rows, scores
+        queries_embeddings = self.get_embeddings(queries, **kwargs)
         # Annoy get_nns_by_vector can only search for one vector at a time
-        for idx, (qid, query) in enumerate(queries.items()):
-            corpus_ids, distances = self.index.get_nns_by_vector(queries_embeddings[idx], topn, include_distances=True)
-            for corpus_id, distance in zip(corpus_ids, distances):
-                score = 1 - (distance ** 2) / 2
-                result[qid][corpus_id] = score
+        for idx in range(len(queries)):
+            rows, distances = self.index.get_nns_by_vector(queries_embeddings[idx], topn, include_distances=True)
+            corpus_rows[idx, :len(rows)] = rows
+            scores[idx, :len(rows)] = 1 - np.asarray(distances) ** 2 / 2
 
-        return result
+        return corpus_rows, scores
 
 
 class HnswlibSimilarity(BertSimilarity):
@@ -122,13 +121,13 @@ class HnswlibSimilarity(BertSimilarity):
             ef_construction: int = 400, M: int = 64, ef: int = 50,
             device: str = None,
     ):
-        super().__init__(corpus, model_name_or_path, device=device)
+        super().__init__(corpus, model_name_or_path, device=device, faiss_index_threshold=None)
         self.embedding_size = self.get_sentence_embedding_dimension()
         self.ef_construction = ef_construction
         self.M = M
         self.ef = ef
         self.index = None
-        if corpus is not None and self.corpus_embeddings:
+        if corpus is not None and len(self.corpus_embeddings):
             self.build_index()
 
     def __str__(self):
@@ -187,31 +186,27 @@ class HnswlibSimilarity(BertSimilarity):
         else:
             logger.warning("No index path given. Index not loaded.")
 
-    def most_similar(self, queries: Union[str, List[str], Dict[str, str]], topn: int = 10,
-                     score_function: str = "cos_sim", **kwargs):
-        """Find the topn most similar texts to the query against the corpus."""
-        result = {}
-        if self.corpus_embeddings and self.index is None:
+    def _most_similar_rows(self, queries: Union[str, List[str]], topn: int = 10,
+                           score_function: str = "cos_sim", query_chunk_size: int = 100, **kwargs):
+        """Find the topn most similar rows of corpus embeddings to the query, return numpy arrays."""
+        if len(self.corpus_embeddings) and self.index is None:
             logger.warning(f"No index found. Please add corpus and build index first, e.g. with `build_index()`."
                            f"Now returning slow search result.")
-            return super().most_similar(queries, topn, score_function=score_function)
-        if not self.corpus_embeddings:
-            logger.error("No corpus_embeddings found. Please add corpus first, e.g. with `add_corpus()`.")
-            return result
-        if isinstance(queries, str) or not hasattr(queries, '__len__'):
+            return super()._most_similar_rows(queries, topn, score_function=score_function,
+                                              query_chunk_size=query_chunk_size, **kwargs)
+        if isinstance(queries, str):
             queries = [queries]
-        if isinstance(queries, list):
-            queries = {id: query for id, query in enumerate(queries)}
-        result = {qid: {} for qid, query in queries.items()}
-        queries_texts = list(queries.values())
-        queries_embeddings = self.get_embeddings(queries_texts, **kwargs)
-        # We use hnswlib knn_query method to find the top_k_hits
-        corpus_ids, distances = self.index.knn_query(queries_embeddings, k=topn)
-        # We extract corpus ids and scores for each query
-        for i, (qid, query) in enumerate(queries.items()):
-            hits = [{'corpus_id': id, 'score': 1 - distance} for id, distance in zip(corpus_ids[i], distances[i])]
-            hits = sorted(hits, key=lambda x: x['score'], reverse=True)
-            for hit in hits:
-                result[qid][hit['corpus_id']] = hit['score']
-
-        return result
+        topn = min(topn, len(self.corpus_embeddings))
+        corpus_rows = np.full((len(queries), topn), -1, dtype=np.int64)
+        scores = np.zeros((len(queries), topn), dtype=np.float32)
+        if not len(self.corpus_embeddings):
+            logger.error("No corpus_embeddings found. Please add corpus first, e.g. with `add_corpus()`.")
+            return corpus_rows, scores
+        if queries:
+            queries_embeddings = self.get_embeddings(queries, **kwargs)
+            # We use hnswlib knn_query method to find the top_k_hits, sorted by increasing distance
+            rows, distances = self.index.knn_query(queries_embeddings, k=topn)
+            corpus_rows = rows.astype(np.int64)
+            scores = (1 - distances).astype(np.float32)
+
+        return corpus_rows, scores
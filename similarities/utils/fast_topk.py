@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Tiled inner product and top-k search, the top-k merge kernel is compiled with numba if it is installed.
+
+The corpus is scored block by block with a BLAS matmul shared by all queries, and each block of scores
+is merged into a sorted topn buffer per query while it is still in cache, so the full
+(num queries, corpus size) score matrix is never materialized.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+prange = numba.prange if numba is not None else range
+
+# Score matrix larger than this size (bytes) does not fit in L3 cache, use the tiled search instead of one matmul
+L3_CACHE_BYTES = 32 * 1024 * 1024
+# Size (bytes) of the score tile of one corpus block
+TILE_BYTES = 4 * 1024 * 1024
+
+
+def _merge_topk(scores, offset, top_rows, top_scores):
+    num_queries, num_docs = scores.shape
+    topn = top_rows.shape[1]
+    for q in prange(num_queries):
+        query_scores = scores[q]
+        rows = top_rows[q]
+        best = top_scores[q]
+        for i in range(num_docs):
+            score = query_scores[i]
+            if score > best[topn - 1]:
+                # Insert into the sorted topn buffer
+                pos = topn - 1
+                while pos > 0 and best[pos - 1] < score:
+                    best[pos] = best[pos - 1]
+                    rows[pos] = rows[pos - 1]
+                    pos -= 1
+                best[pos] = score
+                rows[pos] = offset + i
+
+
+if numba is not None:
+    _merge_topk = numba.njit(parallel=True, fastmath=True, cache=True)(_merge_topk)
+
+
+def is_available():
+    """Whether the numba compiled kernel is available."""
+    return numba is not None
+
+
+def topk_inner_product(queries: np.ndarray, corpus: np.ndarray, topn: int, block_size: int = None):
+    """
+    Find the topn corpus rows with the largest inner product for each query.
+    :param queries: float32 array of shape (num queries, dim)
+    :param corpus: float32 array of shape (corpus size, dim)
+    :param topn: int, should be in range [1, corpus size]
+    :param block_size: number of corpus rows scored at once, default fits the score tile in `TILE_BYTES`
+    :return: (rows, scores), np.ndarray of shape (num queries, topn), sorted by decreasing score
+    """
+    if numba is None:
+        raise ImportError("Numba is not installed. Please install it first, e.g. with `pip install numba`.")
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    if block_size is None:
+        block_size = max(256, TILE_BYTES // (4 * max(1, len(queries))))
+    top_rows = np.full((len(queries), topn), -1, dtype=np.int64)
+    top_scores = np.full((len(queries), topn), np.finfo(np.float32).min, dtype=np.float32)
+    for start_idx in range(0, len(corpus), block_size):
+        block = np.asarray(corpus[start_idx:start_idx + block_size], dtype=np.float32)
+        _merge_topk(queries @ block.T, start_idx, top_rows, top_scores)
+    return top_rows, top_scores
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: OpenMP/BLAS thread settings, and detection of duplicate OpenMP runtimes.
+"""
+import os
+
+import torch
+from loguru import logger
+
+
+def check_openmp_runtimes():
+    """
+    Warn if more than one OpenMP runtime (e.g. conda MKL `libiomp5` and pip torch/faiss `libomp`) is loaded,
+    the runtimes fight for cpu cores, which can halve matmul throughput.
+    Needs `threadpoolctl` to inspect the loaded runtimes, skipped if it is not installed.
+    :return: list of loaded OpenMP runtime names, e.g. ['libiomp', 'libomp']
+    """
+    try:
+        from threadpoolctl import threadpool_info
+    except ImportError:
+        return []
+    runtimes = sorted({info["prefix"] for info in threadpool_info() if info.get("user_api") == "openmp"})
+    if len(runtimes) > 1:
+        logger.warning(f"Multiple OpenMP runtimes are loaded: {runtimes}, they fight for cpu cores and slow down "
+                       f"matmul, install torch, numpy and faiss from the same channel (all conda or all pip).")
+    return runtimes
+
+
+def set_num_threads(num_threads: int = None):
+    """
+    Set the number of threads used by torch, and by OpenMP/BLAS of numpy and faiss if `threadpoolctl` is installed.
+    Unlike the `OMP_NUM_THREADS` environment variable, it also works after numpy and torch are imported.
+    :param num_threads: number of threads, default half of the cpu cores (physical cores with hyper-threading)
+    :return: number of threads
+    """
+    if num_threads is None:
+        num_threads = max(1, (os.cpu_count() or 1) // 2)
+    torch.set_num_threads(num_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        logger.warning("threadpoolctl is not installed, only torch threads are set, "
+                       "install it with `pip install threadpoolctl` to also set numpy and faiss threads.")
+        return num_threads
+    threadpool_limits(limits=num_threads)
+    return num_threads
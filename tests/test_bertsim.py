@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import os
+import shutil
+import sys
+import unittest
+
+import numpy as np
+import torch
+
+sys.path.append('..')
+from similarities.bert_similarity import BertSimilarity
+from similarities.ensemble_similarity import EnsembleSimilarity
+from similarities.literal_similarity import BM25Similarity
+
+corpus = ['如何更换花呗绑定银行卡', '花呗更改绑定银行卡', '我什么时候开通了花呗', '北京天气怎么样', '上海明天下雨吗']
+m = BertSimilarity(corpus=corpus)
+
+
+class CountingModel:
+    """Sentence model stub, records the encoded texts."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, sentences, convert_to_tensor=False, normalize_embeddings=True, **kwargs):
+        self.encoded.extend(sentences)
+        embeddings = torch.tensor([[len(s), sum(map(ord, s)) % 97, 1.0] for s in sentences])
+        if normalize_embeddings:
+            embeddings = torch.nn.functional.normalize(embeddings, dim=1)
+        return embeddings if convert_to_tensor else embeddings.numpy()
+
+
+class BertSimTestCase(unittest.TestCase):
+
+    def test_most_similar_arrays(self):
+        corpus_ids, scores = m.most_similar_arrays(['花呗绑定银行卡', '北京天气'], topn=3)
+        print(corpus_ids, scores)
+        self.assertEqual(corpus_ids.shape, (2, 3))
+        self.assertEqual(scores.shape, (2, 3))
+        self.assertTrue(corpus_ids[0][0] in (0, 1))
+        self.assertEqual(corpus_ids[1][0], 3)
+        self.assertTrue(all(scores[0][i] >= scores[0][i + 1] for i in range(2)))
+
+        r = m.most_similar(['花呗绑定银行卡', '北京天气'], topn=3)
+        print(r)
+        self.assertEqual(list(r[0].keys()), corpus_ids[0].tolist())
+        corpus_ids, scores = m.most_similar_arrays('花呗绑定银行卡', topn=10)
+        self.assertEqual(corpus_ids.shape, (1, len(corpus)))
+
+    def test_similarity_embeddings(self):
+        a = ['如何更换花呗绑定银行卡', '花呗更改绑定银行卡']
+        b = ['花呗更改绑定银行卡', '我什么时候开通了花呗']
+        scores = m.similarity(a, b)
+        self.assertTrue(np.allclose(m.similarity(m.get_embeddings(a), b), scores, atol=1e-5))
+        self.assertTrue(np.allclose(m.similarity(a, m.get_embeddings(b)), scores, atol=1e-5))
+        self.assertTrue(np.allclose(m.similarity(m.get_embeddings(a), m.get_embeddings(b)), scores, atol=1e-5))
+        # Empty text inputs give an empty score matrix
+        self.assertEqual(tuple(m.similarity(m.get_embeddings(a), []).shape), (2, 0))
+        self.assertEqual(tuple(m.similarity([], m.get_embeddings(b)).shape), (0, 2))
+        self.assertEqual(tuple(m.similarity([], []).shape), (0, 0))
+        self.assertEqual(tuple(m.similarity(a, []).shape), (2, 0))
+
+    def test_embedding_cache(self):
+        model = CountingModel()
+        s = BertSimilarity(model_name_or_path=model, embedding_cache_size=2)
+        scores = s.similarity(['a', 'bb'], ['bb', 'a'])
+        # Symmetric pair, each distinct text is encoded once
+        self.assertEqual(sorted(model.encoded), ['a', 'bb'])
+        self.assertTrue(np.allclose(scores, scores.T, atol=1e-6))
+        s.similarity('a', 'bb')
+        self.assertEqual(len(model.encoded), 2)
+        # Cache holds 2 texts, 'a' is the least recently used and is evicted
+        s.similarity('bb', 'ccc')
+        self.assertEqual(model.encoded[2:], ['ccc'])
+        self.assertEqual(len(s._embedding_cache), 2)
+        s.similarity('a', 'ccc')
+        self.assertEqual(model.encoded[3:], ['a'])
+
+        # Cache size 0 disables the cache
+        model = CountingModel()
+        s = BertSimilarity(model_name_or_path=model, embedding_cache_size=0)
+        s.similarity('a', 'bb')
+        s.similarity('a', 'bb')
+        self.assertEqual(model.encoded, ['a', 'bb', 'a', 'bb'])
+        self.assertEqual(len(s._embedding_cache), 0)
+
+    def test_query_chunks(self):
+        queries = ['花呗绑定银行卡', '北京天气', '上海下雨', '开通花呗', '更换银行卡']
+        corpus_ids, scores = m.most_similar_arrays(queries, topn=3)
+        # One query per chunk, the next chunk is encoded while the current one is searched
+        chunked_ids, chunked_scores = m.most_similar_arrays(queries, topn=3, query_chunk_size=1)
+        self.assertEqual(chunked_ids.tolist(), corpus_ids.tolist())
+        self.assertTrue(np.allclose(chunked_scores, scores, atol=1e-5))
+        chunked_ids, _ = m.most_similar_arrays(queries, topn=3, query_chunk_size=2)
+        self.assertEqual(chunked_ids.tolist(), corpus_ids.tolist())
+
+    def test_float16_storage(self):
+        s = BertSimilarity(corpus=corpus, model_name_or_path=m.sentence_model, storage_dtype='float16')
+        self.assertEqual(s.corpus_embeddings.dtype, np.float16)
+        queries = ['花呗绑定银行卡', '北京天气', '上海下雨']
+        corpus_ids, scores = s.most_similar_arrays(queries, topn=3)
+        expected_ids, expected_scores = m.most_similar_arrays(queries, topn=3)
+        self.assertEqual(corpus_ids.tolist(), expected_ids.tolist())
+        self.assertEqual(scores.dtype, np.float32)
+        self.assertTrue(np.allclose(scores, expected_scores, atol=1e-2))
+
+    def test_dict_corpus_ids(self):
+        s = BertSimilarity(model_name_or_path=m.sentence_model)
+        s.add_corpus({'d1': '花呗更改绑定银行卡', 'd2': '北京天气怎么样', 'd3': '花呗更改绑定银行卡'})
+        # Duplicate docs and ids are skipped, list docs get new integer ids
+        s.add_corpus({'d1': '上海明天下雨吗', 5: '我什么时候开通了花呗'})
+        s.add_corpus(['北京天气怎么样', '如何更换花呗绑定银行卡'])
+        self.assertEqual(dict(s.corpus), {'d1': '花呗更改绑定银行卡', 'd2': '北京天气怎么样', 5: '我什么时候开通了花呗',
+                                          6: '如何更换花呗绑定银行卡'})
+        r = s.most_similar(['北京天气怎么样', '如何更换花呗绑定银行卡'], topn=2)
+        print(r)
+        self.assertEqual(list(r[0].keys())[0], 'd2')
+        self.assertEqual(list(r[1].keys())[0], 6)
+
+        # -1 is a valid corpus id, not padding
+        s3 = BertSimilarity(corpus={-1: '北京天气怎么样', 0: '花呗更改绑定银行卡'}, model_name_or_path=m.sentence_model)
+        self.assertEqual(set(s3.most_similar('北京天气', topn=2)[0].keys()), {-1, 0})
+
+        emb_path = 'test_dict_corpus_emb.jsonl'
+        s.save_corpus_embeddings(emb_path)
+        s2 = BertSimilarity(model_name_or_path=m.sentence_model)
+        s2.load_corpus_embeddings(emb_path)
+        self.assertEqual(dict(s2.corpus), dict(s.corpus))
+        self.assertEqual(list(s2.most_similar(['北京天气怎么样'], topn=2)[0].keys()), list(r[0].keys()))
+        for path in [emb_path, f'{emb_path}.npy', f'{emb_path}.meta.json']:
+            os.remove(path)
+
+    def test_ensemble_load_then_add(self):
+        emb_dir = 'test_ensemble_corpus_embs'
+        e = EnsembleSimilarity(similarities=[BertSimilarity(model_name_or_path=m.sentence_model), BM25Similarity()],
+                               weights=[0.5, 0.5], c=2)
+        e.add_corpus(corpus)
+        e.save_corpus_embeddings(emb_dir)
+        e2 = EnsembleSimilarity(similarities=[BertSimilarity(model_name_or_path=m.sentence_model), BM25Similarity()],
+                                weights=[0.5, 0.5], c=2)
+        e2.load_corpus_embeddings(emb_dir)
+        # BM25Similarity has no loader, it gets a mutable copy of the loaded corpus
+        e2.add_corpus(['杭州西湖好玩吗'])
+        self.assertEqual(len(e2.similarities[0].corpus), len(corpus) + 1)
+        self.assertEqual(len(e2.similarities[1].corpus), len(corpus) + 1)
+        r = e2.most_similar('杭州西湖', topn=1)
+        print(r)
+        self.assertEqual(list(r[0].keys()), [len(corpus)])
+        shutil.rmtree(emb_dir)
+
+    def test_faiss_index(self):
+        queries = ['花呗绑定银行卡', '北京天气']
+        exact_ids, exact_scores = m.most_similar_arrays(queries, topn=3)
+        for factory in ['Flat', 'SQ8']:
+            f = BertSimilarity(corpus=corpus, model_name_or_path=m.sentence_model, faiss_index_factory=factory,
+                               faiss_index_threshold=2)
+            self.assertIsNotNone(f.faiss_index)
+            # Only duplicate docs, nothing is encoded or added to the index
+            f.add_corpus([corpus[0]])
+            self.assertEqual(f.faiss_index.ntotal, len(corpus))
+            corpus_ids, scores = f.most_similar_arrays(queries, topn=3)
+            print(factory, corpus_ids, scores)
+            self.assertEqual(corpus_ids.tolist(), exact_ids.tolist())
+            self.assertTrue(np.allclose(scores, exact_scores, atol=1e-2))
+
+        # Save and load the trained index instead of retraining it
+        emb_path = 'test_faiss_corpus_emb.jsonl'
+        f.save_corpus_embeddings(emb_path)
+        self.assertTrue(os.path.exists(f'{emb_path}.index'))
+        f2 = BertSimilarity(model_name_or_path=m.sentence_model, faiss_index_factory='SQ8', faiss_index_threshold=2)
+        f2.load_corpus_embeddings(emb_path)
+        self.assertEqual(f2.faiss_index.ntotal, len(corpus))
+        self.assertEqual(f2.most_similar_arrays(queries, topn=3)[0].tolist(), exact_ids.tolist())
+        for path in [emb_path, f'{emb_path}.npy', f'{emb_path}.meta.json', f'{emb_path}.index']:
+            os.remove(path)
+
+    def test_faiss_index_too_small_corpus(self):
+        # IVF256 needs at least 256 training docs, fall back to exhaustive search
+        f = BertSimilarity(corpus=corpus, model_name_or_path=m.sentence_model, faiss_index_factory='IVF256,PQ16',
+                           faiss_index_threshold=2)
+        self.assertIsNone(f.faiss_index)
+        self.assertEqual(f.most_similar_arrays('北京天气', topn=1)[0][0][0], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
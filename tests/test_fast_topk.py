@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append('..')
+from similarities.utils import fast_topk
+
+
+@unittest.skipUnless(fast_topk.is_available(), "numba is not installed")
+class FastTopkTestCase(unittest.TestCase):
+
+    def test_topk_inner_product(self):
+        rng = np.random.default_rng(42)
+        queries = rng.standard_normal((7, 32), dtype=np.float32)
+        corpus = rng.standard_normal((1000, 32), dtype=np.float32)
+        scores = queries @ corpus.T
+        for topn in [1, 10, 1000]:
+            expected_rows = np.argpartition(-scores, topn - 1, axis=1)[:, :topn]
+            expected_scores = np.sort(np.take_along_axis(scores, expected_rows, axis=1), axis=1)[:, ::-1]
+            # Small blocks so the topn buffers are merged across many corpus blocks
+            rows, top_scores = fast_topk.topk_inner_product(queries, corpus, topn, block_size=64)
+            self.assertEqual(rows.shape, (7, topn))
+            self.assertEqual(np.sort(rows, axis=1).tolist(), np.sort(expected_rows, axis=1).tolist())
+            self.assertTrue(np.allclose(top_scores, expected_scores, atol=1e-4))
+            self.assertTrue(np.all(np.diff(top_scores, axis=1) <= 0))
+
+
+if __name__ == '__main__':
+    unittest.main()